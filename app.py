@@ -1,15 +1,24 @@
 # app.py
+import mimetypes
 import os
-from flask import Flask, request, jsonify, g, send_from_directory
+import threading
+import orjson
+from cachetools import TTLCache
+from flask import Flask, Response, abort, request, jsonify, g, send_from_directory
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import or_, func
+from sqlalchemy import or_, func, insert, select, cast, literal_column, lambda_stmt, Text
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from flasgger import Swagger
+from werkzeug.utils import secure_filename
 
 from database import SessionLocal
-from models import Chapter, Article, Tariff
-from utils import admin_required, save_photo, delete_photo, UPLOAD_FOLDER
+from models import Chapter, Article, Tariff, CHAPTER_JSON, ARTICLE_JSON
+from schemas import ChapterUpdate, ArticleCreate, ArticleUpdate, parse_form
+from utils import admin_required, save_photo, UploadRequest, UPLOAD_FOLDER, UPLOAD_TMP_FOLDER
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 
 # --- Конфигурация Swagger ---
 swagger_config = {
@@ -39,10 +48,64 @@ swagger = Swagger(app, config=swagger_config)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-
-# Создаем папку для загрузок, если её нет
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# Раздача загрузок веб-сервером вместо Python:
+# UPLOADS_ACCEL_PREFIX — internal-location nginx для X-Accel-Redirect (например, /_uploads/),
+# USE_X_SENDFILE=1 — заголовок X-Sendfile для Apache/lighttpd
+app.config['UPLOADS_ACCEL_PREFIX'] = os.getenv('UPLOADS_ACCEL_PREFIX')
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'
+# Загруженные файлы никогда не перезаписываются, поэтому их можно долго кэшировать
+app.config['UPLOADS_MAX_AGE'] = 365 * 24 * 60 * 60
+
+# Создаем папки для загрузок, если их нет
+os.makedirs(UPLOAD_TMP_FOLDER, exist_ok=True)
+
+# --- Кэш готовых JSON-ответов для редко меняющихся данных ---
+# Кэш локален для процесса: изменения из других воркеров видны после истечения TTL
+CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+CHAPTERS_CACHE = TTLCache(maxsize=1024, ttl=CACHE_TTL)
+TARIFFS_CACHE = TTLCache(maxsize=256, ttl=CACHE_TTL)
+_cache_lock = threading.Lock()
+
+def cache_get(cache, key):
+    with _cache_lock:
+        return cache.get(key)
+
+def cache_set(cache, key, body):
+    with _cache_lock:
+        cache[key] = body
+
+def invalidate_chapters_cache():
+    with _cache_lock:
+        CHAPTERS_CACHE.clear()
+
+def json_response(body, status=200):
+    """Отдает заранее сериализованный JSON без повторного кодирования."""
+    return Response(body, status=status, mimetype='application/json')
+
+def json_list(db, json_object, order_by, *criteria):
+    """Собирает JSON-массив целиком в PostgreSQL (json_agg) и возвращает его текстом."""
+    stmt = select(
+        cast(
+            func.coalesce(
+                func.json_agg(aggregate_order_by(json_object, order_by)),
+                literal_column("'[]'::json")
+            ),
+            Text
+        )
+    ).where(*criteria)
+    return db.execute(stmt).scalar_one()
+
+# Пространства ключей для pg_advisory_xact_lock при вычислении order
+ORDER_LOCK_CHAPTERS = 1
+ORDER_LOCK_ARTICLES = 2
+
+def lock_order(db, namespace, key=0):
+    """Сериализует вычисление MAX(order)+1 до конца транзакции.
+
+    В READ COMMITTED параллельные INSERT не видят незакоммиченные строки
+    друг друга и без блокировки получили бы одинаковый order.
+    """
+    db.execute(select(func.pg_advisory_xact_lock(namespace, key)))
 
 # --- Управление сессией БД ---
 @app.before_request
@@ -51,14 +114,24 @@ def before_request():
 
 @app.teardown_appcontext
 def teardown_appcontext(exception=None):
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    g.pop('db', None)
+    SessionLocal.remove()
 
 # --- Роут для раздачи загруженных файлов ---
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    max_age = app.config['UPLOADS_MAX_AGE']
+    accel_prefix = app.config['UPLOADS_ACCEL_PREFIX']
+    if accel_prefix:
+        if secure_filename(filename) != filename:
+            abort(404)
+        # Файл отдает nginx (sendfile без копирования через Python)
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel_prefix + filename
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, conditional=True, max_age=max_age)
 
 # --- Эндпоинты для РАЗДЕЛОВ (Chapters) ---
 
@@ -105,13 +178,16 @@ def create_chapter():
     if error:
         return jsonify({"error": error}), 400
 
-    max_order = db.query(func.max(Chapter.order)).scalar()
-    new_order = (max_order or 0) + 1
-
-    new_chapter = Chapter(title=title, order=new_order, photo_path=photo_filename)
-    db.add(new_chapter)
+    # order вычисляется подзапросом в том же INSERT, без отдельного SELECT MAX
+    lock_order(db, ORDER_LOCK_CHAPTERS)
+    next_order = select(func.coalesce(func.max(Chapter.order), 0) + 1).scalar_subquery()
+    new_chapter = db.execute(
+        insert(Chapter)
+        .values(title=title, order=next_order, photo_path=photo_filename)
+        .returning(Chapter)
+    ).scalar_one()
     db.commit()
-    db.refresh(new_chapter)
+    invalidate_chapters_cache()
     return jsonify(new_chapter.to_dict()), 201
 
 @app.route('/chapters/<int:chapter_id>', methods=['GET'])
@@ -132,10 +208,18 @@ def get_chapter(chapter_id):
       404:
         description: Раздел не найден
     """
-    chapter = g.db.query(Chapter).filter(Chapter.id == chapter_id).first()
-    if not chapter:
-        return jsonify({"error": "Chapter not found"}), 404
-    return jsonify(chapter.to_dict())
+    key = ('chapter', chapter_id)
+    body = cache_get(CHAPTERS_CACHE, key)
+    if body is None:
+        # lambda_stmt кэширует и само выражение, и его SQL между запросами
+        chapter = g.db.execute(
+            lambda_stmt(lambda: select(Chapter).where(Chapter.id == chapter_id))
+        ).scalars().first()
+        if not chapter:
+            return jsonify({"error": "Chapter not found"}), 404
+        body = orjson.dumps(chapter.to_dict())
+        cache_set(CHAPTERS_CACHE, key, body)
+    return json_response(body)
 
 @app.route('/chapters', methods=['GET'])
 def get_all_chapters():
@@ -148,8 +232,12 @@ def get_all_chapters():
       200:
         description: Список всех разделов, отсортированных по полю order
     """
-    chapters = g.db.query(Chapter).order_by(Chapter.order).all()
-    return jsonify([c.to_dict() for c in chapters])
+    key = ('chapters',)
+    body = cache_get(CHAPTERS_CACHE, key)
+    if body is None:
+        body = json_list(g.db, CHAPTER_JSON, Chapter.order)
+        cache_set(CHAPTERS_CACHE, key, body)
+    return json_response(body)
 
 @app.route('/chapters/search', methods=['GET'])
 def search_chapters():
@@ -173,8 +261,7 @@ def search_chapters():
     if not query:
         return jsonify({"error": "Search query 'title' is required"}), 400
     
-    chapters = g.db.query(Chapter).filter(Chapter.title.ilike(f'%{query}%')).order_by(Chapter.order).all()
-    return jsonify([c.to_dict() for c in chapters])
+    return json_response(json_list(g.db, CHAPTER_JSON, Chapter.order, Chapter.title.ilike(f'%{query}%')))
     
 @app.route('/chapters', methods=['PUT'])
 @admin_required
@@ -209,30 +296,26 @@ def update_chapter():
         description: Раздел не найден
     """
     db = g.db
-    data = request.form
     file = request.files.get('photo')
-    chapter_id = data.get('id')
-
-    if not chapter_id:
-        return jsonify({"error": "Chapter ID is required in body"}), 400
+    payload, error = parse_form(ChapterUpdate, request.form)
+    if error:
+        return jsonify({"error": error}), 400
 
-    chapter = db.query(Chapter).filter(Chapter.id == chapter_id).first()
+    chapter = db.query(Chapter).filter(Chapter.id == payload.id).first()
     if not chapter:
         return jsonify({"error": "Chapter not found"}), 404
 
-    if 'title' in data:
-        chapter.title = data['title']
-    if 'order' in data:
-        chapter.order = int(data['order'])
-    
+    for key, value in payload.model_dump(exclude_unset=True, exclude={'id'}).items():
+        setattr(chapter, key, value)
+
     if file:
-        delete_photo(chapter.photo_path)
         photo_filename, error = save_photo(file)
         if error:
             return jsonify({"error": error}), 400
         chapter.photo_path = photo_filename
 
     db.commit()
+    invalidate_chapters_cache()
     return jsonify(chapter.to_dict())
 
 @app.route('/chapters/<int:chapter_id>', methods=['DELETE'])
@@ -261,9 +344,9 @@ def delete_chapter(chapter_id):
     if not chapter:
         return jsonify({"error": "Chapter not found"}), 404
     
-    delete_photo(chapter.photo_path)
     db.delete(chapter)
     db.commit()
+    invalidate_chapters_cache()
     return jsonify({"message": "Chapter deleted successfully"})
 
 @app.route('/chapters/order', methods=['PATCH'])
@@ -301,16 +384,18 @@ def update_chapters_order():
         return jsonify({"error": "Invalid data format. Expected a list of objects."}), 400
     
     try:
-        chapter_map = {c.id: c for c in db.query(Chapter).filter(Chapter.id.in_([item['id'] for item in order_data])).all()}
-        for item in order_data:
-            if item['id'] in chapter_map:
-                chapter_map[item['id']].order = item['order']
-            else:
-                raise NoResultFound
+        mappings = [{'id': item['id'], 'order': item['order']} for item in order_data]
+        ids = [m['id'] for m in mappings]
+        existing = {row[0] for row in db.query(Chapter.id).filter(Chapter.id.in_(ids)).all()}
+        missing = [i for i in ids if i not in existing]
+        if missing:
+            raise NoResultFound
+        db.bulk_update_mappings(Chapter, mappings)
         db.commit()
+        invalidate_chapters_cache()
     except NoResultFound:
         db.rollback()
-        return jsonify({"error": f"Chapter with id {item.get('id')} not found"}), 404
+        return jsonify({"error": f"Chapter with id {missing[0]} not found"}), 404
     except Exception as e:
         db.rollback()
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
@@ -359,31 +444,36 @@ def create_article():
         description: Раздел для статьи не найден
     """
     db = g.db
-    data = request.form
     file = request.files.get('photo')
+    payload, error = parse_form(ArticleCreate, request.form)
+    if error:
+        return jsonify({"error": error}), 400
 
-    required_fields = ['title', 'description', 'link', 'chapter_id']
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": "Missing required fields"}), 400
-
-    chapter_id = int(data['chapter_id'])
-    if not db.query(Chapter).filter(Chapter.id == chapter_id).first():
-        return jsonify({"error": f"Chapter with id {chapter_id} not found"}), 404
-
+    chapter_id = payload.chapter_id
     photo_filename, error = save_photo(file)
     if error:
         return jsonify({"error": error}), 400
 
-    max_order = db.query(func.max(Article.order)).filter(Article.chapter_id == chapter_id).scalar()
-    new_order = (max_order or 0) + 1
-
-    new_article = Article(
-        title=data['title'], description=data['description'], link=data['link'],
-        order=new_order, chapter_id=chapter_id, photo_path=photo_filename
+    lock_order(db, ORDER_LOCK_ARTICLES, chapter_id)
+    next_order = (
+        select(func.coalesce(func.max(Article.order), 0) + 1)
+        .where(Article.chapter_id == chapter_id)
+        .scalar_subquery()
     )
-    db.add(new_article)
-    db.commit()
-    db.refresh(new_article)
+    # Существование раздела гарантирует внешний ключ: отдельный SELECT не нужен
+    try:
+        new_article = db.execute(
+            insert(Article)
+            .values(
+                title=payload.title, description=payload.description, link=payload.link,
+                order=next_order, chapter_id=chapter_id, photo_path=photo_filename
+            )
+            .returning(Article)
+        ).scalar_one()
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return jsonify({"error": f"Chapter with id {chapter_id} not found"}), 404
     return jsonify(new_article.to_dict()), 201
 
 @app.route('/articles/<int:article_id>', methods=['GET'])
@@ -425,8 +515,7 @@ def get_articles_by_chapter(chapter_id):
       200:
         description: Список статей раздела
     """
-    articles = g.db.query(Article).filter(Article.chapter_id == chapter_id).order_by(Article.order).all()
-    return jsonify([a.to_dict() for a in articles])
+    return json_response(json_list(g.db, ARTICLE_JSON, Article.order, Article.chapter_id == chapter_id))
 
 @app.route('/articles/search', methods=['GET'])
 def search_articles():
@@ -449,10 +538,10 @@ def search_articles():
         return jsonify({"error": "Search query 'q' is required"}), 400
     
     search_term = f'%{query}%'
-    articles = g.db.query(Article).filter(
+    return json_response(json_list(
+        g.db, ARTICLE_JSON, Article.order,
         or_(Article.title.ilike(search_term), Article.description.ilike(search_term))
-    ).order_by(Article.order).all()
-    return jsonify([a.to_dict() for a in articles])
+    ))
 
 @app.route('/articles', methods=['PUT'])
 @admin_required
@@ -496,24 +585,19 @@ def update_article():
         description: Статья не найдена
     """
     db = g.db
-    data = request.form
     file = request.files.get('photo')
-    article_id = data.get('id')
-
-    if not article_id:
-        return jsonify({"error": "Article ID is required in body"}), 400
+    payload, error = parse_form(ArticleUpdate, request.form)
+    if error:
+        return jsonify({"error": error}), 400
 
-    article = db.query(Article).filter(Article.id == article_id).first()
+    article = db.query(Article).filter(Article.id == payload.id).first()
     if not article:
         return jsonify({"error": "Article not found"}), 404
 
-    for key in ['title', 'description', 'link', 'order', 'chapter_id']:
-        if key in data:
-            value = int(data[key]) if key in ['order', 'chapter_id'] else data[key]
-            setattr(article, key, value)
+    for key, value in payload.model_dump(exclude_unset=True, exclude={'id'}).items():
+        setattr(article, key, value)
 
     if file:
-        delete_photo(article.photo_path)
         photo_filename, error = save_photo(file)
         if error:
             return jsonify({"error": error}), 400
@@ -548,7 +632,6 @@ def delete_article(article_id):
     if not article:
         return jsonify({"error": "Article not found"}), 404
     
-    delete_photo(article.photo_path)
     db.delete(article)
     db.commit()
     return jsonify({"message": "Article deleted successfully"})
@@ -588,16 +671,17 @@ def update_articles_order():
         return jsonify({"error": "Invalid data format. Expected a list of objects."}), 400
     
     try:
-        article_map = {a.id: a for a in db.query(Article).filter(Article.id.in_([item['id'] for item in order_data])).all()}
-        for item in order_data:
-            if item['id'] in article_map:
-                article_map[item['id']].order = item['order']
-            else:
-                raise NoResultFound
+        mappings = [{'id': item['id'], 'order': item['order']} for item in order_data]
+        ids = [m['id'] for m in mappings]
+        existing = {row[0] for row in db.query(Article.id).filter(Article.id.in_(ids)).all()}
+        missing = [i for i in ids if i not in existing]
+        if missing:
+            raise NoResultFound
+        db.bulk_update_mappings(Article, mappings)
         db.commit()
     except NoResultFound:
         db.rollback()
-        return jsonify({"error": f"Article with id {item.get('id')} not found"}), 404
+        return jsonify({"error": f"Article with id {missing[0]} not found"}), 404
     except Exception as e:
         db.rollback()
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
@@ -624,10 +708,17 @@ def get_tariff(tariff_id):
       404:
         description: Активный тариф не найден
     """
-    tariff = g.db.query(Tariff).filter(Tariff.id == tariff_id, Tariff.is_active == True).first()
-    if not tariff:
-        return jsonify({"error": "Active tariff not found"}), 404
-    return jsonify(tariff.to_dict())
+    key = ('tariff', tariff_id)
+    body = cache_get(TARIFFS_CACHE, key)
+    if body is None:
+        tariff = g.db.execute(
+            lambda_stmt(lambda: select(Tariff).where(Tariff.id == tariff_id, Tariff.is_active == True))
+        ).scalars().first()
+        if not tariff:
+            return jsonify({"error": "Active tariff not found"}), 404
+        body = orjson.dumps(tariff.to_dict())
+        cache_set(TARIFFS_CACHE, key, body)
+    return json_response(body)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
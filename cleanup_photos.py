@@ -0,0 +1,41 @@
+# cleanup_photos.py
+import os
+import time
+from sqlalchemy import select, union
+from database import SessionLocal
+from models import Chapter, Article
+from utils import UPLOAD_FOLDER, UPLOAD_TMP_FOLDER, delete_photo
+
+# Файлы моложе этого срока не трогаем: запрос мог уже сохранить фото,
+# но еще не закоммитить строку, которая на него ссылается
+ORPHAN_GRACE_PERIOD = int(os.getenv("ORPHAN_GRACE_PERIOD", str(60 * 60)))
+
+# Удаляет фото, на которые не ссылается ни один раздел или статья.
+# Файлы названы по хэшу содержимого и могут быть общими для нескольких
+# записей, поэтому эндпоинты их не удаляют; скрипт запускается по cron
+def cleanup_photos():
+    db = SessionLocal()
+    try:
+        referenced = set(db.execute(
+            union(select(Chapter.photo_path), select(Article.photo_path))
+        ).scalars())
+    finally:
+        SessionLocal.remove()
+
+    # Ссылки прочитаны до проверки mtime: файл, переиспользованный после
+    # чтения ссылок, получит свежий mtime в save_photo и будет пропущен
+    cutoff = time.time() - ORPHAN_GRACE_PERIOD
+    removed = 0
+    for entry in os.scandir(UPLOAD_FOLDER):
+        if entry.is_file() and entry.name not in referenced and entry.stat().st_mtime < cutoff:
+            delete_photo(entry.name)
+            removed += 1
+    # Временные файлы загрузок, оставшиеся после аварийно завершенных воркеров
+    for entry in os.scandir(UPLOAD_TMP_FOLDER):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+            removed += 1
+    print(f"Removed {removed} orphaned files.")
+
+if __name__ == "__main__":
+    cleanup_photos()
@@ -1,23 +1,59 @@
 # database.py
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Под gevent-воркерами Gunicorn ожидание ответа от PostgreSQL должно
+# переключать гринлеты, а не блокировать весь процесс. psycogreen патчит
+# только psycopg2: DATABASE_URL должен использовать этот драйвер
+# (postgresql+psycopg2://..., либо postgresql:// при SQLAlchemy < 2.1)
+if os.getenv("DB_GEVENT") == "1":
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+# Параметры пула соединений (можно переопределить через .env).
+# Пул у каждого процесса свой: воркеры × (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# должно укладываться в max_connections PostgreSQL (по умолчанию 100)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Размер кэша скомпилированных SQL-выражений (по умолчанию в SQLAlchemy 500)
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE,
+    query_cache_size=DB_QUERY_CACHE_SIZE,
+)
+# Сессия привязана к текущему потоку; закрывается через SessionLocal.remove().
+# Сессия живет один запрос, поэтому объекты не сбрасываются после commit():
+# иначе to_dict() после коммита выполняет лишний SELECT для перечитывания строки
+SessionLocal = scoped_session(
+    sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+)
 Base = declarative_base()
 
 # Функция для создания таблиц в БД
 def init_db():
     # Импортируем модели здесь, чтобы избежать циклических импортов
     import models
+    # Расширение нужно для триграммных индексов поиска
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
     Base.metadata.create_all(bind=engine)
+    # create_all не добавляет новые индексы к уже существующим таблицам
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     print("Database tables created successfully.")
 
 # Этот блок позволяет запустить скрипт для инициализации БД
@@ -0,0 +1,11 @@
+# gunicorn.conf.py
+# Запуск: gunicorn app:app
+import os
+
+# Включаем кооперативный драйвер psycopg2 в database.py
+os.environ.setdefault("DB_GEVENT", "1")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+worker_class = "gevent"
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
@@ -1,6 +1,6 @@
 # models.py
 import os
-from sqlalchemy import Column, Integer, String, Text, BigInteger, ForeignKey, NUMERIC, Boolean
+from sqlalchemy import Column, Integer, String, Text, BigInteger, ForeignKey, NUMERIC, Boolean, Index, case, func, literal
 from sqlalchemy.orm import relationship
 from database import Base
 from dotenv import load_dotenv
@@ -8,25 +8,45 @@ from dotenv import load_dotenv
 load_dotenv()
 BASE_IMAGE_URL = os.getenv("BASE_IMAGE_URL", "http://127.0.0.1:5000/uploads/")
 
+# Триграммный GIN-индекс (расширение pg_trgm) ускоряет поиск ILIKE '%...%'
+def trgm_index(name, column):
+    return Index(name, column, postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
 class Chapter(Base):
     __tablename__ = 'chapters'
+    __table_args__ = (
+        Index('ix_chapters_order', 'order'),
+        trgm_index('ix_chapters_title_trgm', 'title'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     photo_path = Column(String(500))
     title = Column(String(250))
     order = Column(Integer)
     
-    articles = relationship("Article", back_populates="chapter", cascade="all, delete-orphan")
+    # Статьи удаляются каскадом на стороне БД (ondelete='CASCADE'), поэтому
+    # при удалении раздела коллекция не подгружается и не удаляется построчно
+    articles = relationship(
+        "Article", back_populates="chapter",
+        cascade="all, delete-orphan", passive_deletes=True
+    )
 
-    def to_dict(self):
+    # _base привязывается при определении класса: без поиска глобального имени
+    # и без f-строки на каждую строку списка
+    def to_dict(self, _base=BASE_IMAGE_URL):
         return {
             'id': self.id,
             'title': self.title,
-            'photo_url': f"{BASE_IMAGE_URL}{self.photo_path}" if self.photo_path else None,
+            'photo_url': _base + self.photo_path if self.photo_path else None,
             'order': self.order
         }
 
 class Article(Base):
     __tablename__ = 'articles'
+    __table_args__ = (
+        Index('ix_articles_chapter_order', 'chapter_id', 'order'),
+        trgm_index('ix_articles_title_trgm', 'title'),
+        trgm_index('ix_articles_description_trgm', 'description'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     photo_path = Column(String(500))
     title = Column(String(250))
@@ -37,17 +57,38 @@ class Article(Base):
 
     chapter = relationship("Chapter", back_populates="articles")
 
-    def to_dict(self):
+    def to_dict(self, _base=BASE_IMAGE_URL):
         return {
             'id': self.id,
             'title': self.title,
             'description': self.description,
             'link': self.link,
-            'photo_url': f"{BASE_IMAGE_URL}{self.photo_path}" if self.photo_path else None,
+            'photo_url': _base + self.photo_path if self.photo_path else None,
             'order': self.order,
             'chapter_id': self.chapter_id
         }
 
+# --- JSON-представления для сборки списков на стороне PostgreSQL ---
+# Ключи совпадают с to_dict()
+def photo_url_sql(column, _base=BASE_IMAGE_URL):
+    return case((column != '', literal(_base) + column))
+
+CHAPTER_JSON = func.json_build_object(
+    'id', Chapter.id,
+    'title', Chapter.title,
+    'photo_url', photo_url_sql(Chapter.photo_path),
+    'order', Chapter.order
+)
+ARTICLE_JSON = func.json_build_object(
+    'id', Article.id,
+    'title', Article.title,
+    'description', Article.description,
+    'link', Article.link,
+    'photo_url', photo_url_sql(Article.photo_path),
+    'order', Article.order,
+    'chapter_id', Article.chapter_id
+)
+
 class Tariff(Base):
     __tablename__ = 'tariffs'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -0,0 +1,37 @@
+# schemas.py
+from typing import Optional
+from pydantic import BaseModel, Field, ValidationError
+
+# chapters.id — Integer (int4): большие значения не могут существовать и
+# не подходят для pg_advisory_xact_lock(int, int)
+MAX_INT4 = 2**31 - 1
+
+# --- Схемы данных форм (multipart/form-data) ---
+class ChapterUpdate(BaseModel):
+    id: int
+    title: Optional[str] = None
+    order: Optional[int] = None
+
+class ArticleCreate(BaseModel):
+    title: str
+    description: str
+    link: str
+    chapter_id: int = Field(ge=1, le=MAX_INT4)
+
+class ArticleUpdate(BaseModel):
+    id: int
+    title: Optional[str] = None
+    description: Optional[str] = None
+    link: Optional[str] = None
+    order: Optional[int] = None
+    chapter_id: Optional[int] = Field(default=None, ge=1, le=MAX_INT4)
+
+def parse_form(schema, form):
+    """Проверяет и приводит типы полей формы. Возвращает (данные, ошибка)."""
+    try:
+        return schema.model_validate(form.to_dict()), None
+    except ValidationError as e:
+        details = "; ".join(
+            f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()
+        )
+        return None, f"Invalid request data: {details}"
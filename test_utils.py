@@ -0,0 +1,73 @@
+# test_utils.py
+import io
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import utils
+
+
+def make_png(width=160, height=90):
+    buf = io.BytesIO()
+    Image.new('RGB', (width, height), 'white').save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class SavePhotoTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        upload_folder = self.tmpdir.name
+        upload_tmp_folder = os.path.join(upload_folder, '.tmp')
+        os.makedirs(upload_tmp_folder)
+        for name, value in [('UPLOAD_FOLDER', upload_folder), ('UPLOAD_TMP_FOLDER', upload_tmp_folder)]:
+            patcher = mock.patch.object(utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assert_saved(self, filename, error, data):
+        self.assertIsNone(error)
+        filepath = os.path.join(utils.UPLOAD_FOLDER, filename)
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(stat.S_IMODE(os.stat(filepath).st_mode), utils.UPLOAD_FILE_MODE)
+
+    def test_saves_valid_png_from_memory(self):
+        data = make_png()
+        file = FileStorage(stream=io.BytesIO(data), filename='cover.png')
+        filename, error = utils.save_photo(file)
+        self.assert_saved(filename, error, data)
+        self.assertTrue(filename.endswith('.png'))
+
+    def test_moves_spooled_upload_into_place(self):
+        data = make_png()
+        tmp = tempfile.NamedTemporaryFile(dir=utils.UPLOAD_TMP_FOLDER, delete=False)
+        tmp.write(data)
+        tmp.seek(0)
+        filename, error = utils.save_photo(FileStorage(stream=tmp, filename='cover.png'))
+        self.assert_saved(filename, error, data)
+        self.assertFalse(os.path.exists(tmp.name))
+
+    def test_same_content_reuses_file(self):
+        data = make_png()
+        first, _ = utils.save_photo(FileStorage(stream=io.BytesIO(data), filename='a.png'))
+        second, _ = utils.save_photo(FileStorage(stream=io.BytesIO(data), filename='b.png'))
+        self.assertEqual(first, second)
+
+    def test_rejects_wrong_aspect_ratio(self):
+        file = FileStorage(stream=io.BytesIO(make_png(100, 100)), filename='square.png')
+        filename, error = utils.save_photo(file)
+        self.assertIsNone(filename)
+        self.assertIn('Invalid aspect ratio', error)
+        self.assertEqual([e for e in os.listdir(utils.UPLOAD_FOLDER) if e != '.tmp'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,25 +1,64 @@
 # utils.py
+import hashlib
 import os
-import uuid
+import tempfile
 from functools import wraps
-from flask import request, jsonify
+from flask import Request, request, jsonify
 from PIL import Image
-from werkzeug.utils import secure_filename
 
 # --- Конфигурация ---
 UPLOAD_FOLDER = 'uploads'
+# Временные файлы загрузок лежат на той же ФС, что и UPLOAD_FOLDER,
+# чтобы перенос в итоговый файл был простым os.replace
+UPLOAD_TMP_FOLDER = os.path.join(UPLOAD_FOLDER, '.tmp')
+# Загрузки больше этого размера пишутся сразу во временный файл
+UPLOAD_MEMORY_THRESHOLD = 1024 * 1024
+# Временные файлы создаются с правами 0600; итоговые файлы должны быть
+# доступны веб-серверу (nginx обычно работает под другим пользователем)
+UPLOAD_FILE_MODE = 0o644
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# Форматы Pillow, соответствующие разрешенным расширениям
+ALLOWED_IMAGE_FORMATS = ('PNG', 'JPEG', 'GIF')
 # Требуемое соотношение сторон (16:9) с погрешностью 5%
 ASPECT_RATIO = 16 / 9
 ASPECT_RATIO_TOLERANCE = 0.05
 
 # Загружаем ID админов из .env
-ADMIN_TELEGRAM_IDS = os.getenv('ADMIN_TELEGRAM_IDS', '').split(',')
+ADMIN_TELEGRAM_IDS = frozenset(x.strip() for x in os.getenv('ADMIN_TELEGRAM_IDS', '').split(',') if x.strip())
 
 def allowed_file(filename):
     """Проверяет, разрешено ли расширение файла."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# --- Запрос, сохраняющий крупные загрузки во временные файлы ---
+class UploadRequest(Request):
+    max_form_memory_size = UPLOAD_MEMORY_THRESHOLD
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._upload_tmp_paths = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > UPLOAD_MEMORY_THRESHOLD:
+            tmp = tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_FOLDER, delete=False)
+            self._upload_tmp_paths.append(tmp.name)
+            return tmp
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+    def close(self):
+        super().close()
+        # Удаляем временные файлы, которые не были перенесены в save_photo
+        for path in self._upload_tmp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+def _upload_tmp_path(stream):
+    """Возвращает путь временного файла загрузки, если поток хранится в UPLOAD_TMP_FOLDER."""
+    path = getattr(stream, 'name', None)
+    if isinstance(path, str) and os.path.dirname(os.path.abspath(path)) == os.path.abspath(UPLOAD_TMP_FOLDER):
+        return path
+    return None
+
 # --- Декоратор для проверки прав администратора ---
 def admin_required(f):
     @wraps(f)
@@ -31,6 +70,27 @@ def admin_required(f):
     return decorated_function
 
 # --- Функции для работы с изображениями ---
+def _write_atomic(filepath, data):
+    """Записывает файл через временный, чтобы читатели не видели его частично записанным."""
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_FOLDER, delete=False) as tmp:
+        try:
+            tmp.write(data)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    os.chmod(tmp.name, UPLOAD_FILE_MODE)
+    os.replace(tmp.name, filepath)
+
+def _claim_existing(filepath):
+    """Обновляет mtime уже сохраненного файла, чтобы cleanup_photos.py не удалил его
+    до коммита ссылающейся строки. Возвращает False, если файла нет."""
+    try:
+        os.utime(filepath)
+        return True
+    except FileNotFoundError:
+        return False
+
 def save_photo(file):
     """Сохраняет фото, проверяет расширение и соотношение сторон."""
     if not file or file.filename == '':
@@ -39,29 +99,54 @@ def save_photo(file):
     if not allowed_file(file.filename):
         return None, "Invalid file type. Allowed types: png, jpg, jpeg, gif"
 
-    filename = secure_filename(f"{uuid.uuid4()}.{file.filename.rsplit('.', 1)[1].lower()}")
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    
+    ext = file.filename.rsplit('.', 1)[1].lower()
+
+    # Сначала проверяем изображение прямо из потока загрузки, без записи на диск.
+    # Image.open читает только заголовок; пиксели не декодируются, пока не
+    # вызван load(), а formats ограничивает перебор плагинов Pillow
     try:
-        # Сначала сохраняем, потом проверяем
-        file.save(filepath)
-
-        with Image.open(filepath) as img:
-            width, height = img.size
-            if height == 0:
-                raise ValueError("Image height cannot be zero.")
-            
-            actual_ratio = width / height
-            lower_bound = ASPECT_RATIO * (1 - ASPECT_RATIO_TOLERANCE)
-            upper_bound = ASPECT_RATIO * (1 + ASPECT_RATIO_TOLERANCE)
-
-            if not (lower_bound <= actual_ratio <= upper_bound):
-                os.remove(filepath) # Удаляем некорректный файл
-                error_msg = f"Invalid aspect ratio. Required: ~{ASPECT_RATIO:.2f}, found: {actual_ratio:.2f}"
-                return None, error_msg
+        img = Image.open(file.stream, formats=ALLOWED_IMAGE_FORMATS)
+        width, height = img.size
+        # img.close() закрыл бы и переданный поток загрузки, поэтому объект просто отпускаем
+        del img
+        file.stream.seek(0)
+    except Exception as e:
+        return None, f"Error processing image: {str(e)}"
+
+    if height == 0:
+        return None, "Error processing image: Image height cannot be zero."
+
+    actual_ratio = width / height
+    lower_bound = ASPECT_RATIO * (1 - ASPECT_RATIO_TOLERANCE)
+    upper_bound = ASPECT_RATIO * (1 + ASPECT_RATIO_TOLERANCE)
+
+    if not (lower_bound <= actual_ratio <= upper_bound):
+        error_msg = f"Invalid aspect ratio. Required: ~{ASPECT_RATIO:.2f}, found: {actual_ratio:.2f}"
+        return None, error_msg
+
+    # Имя файла — SHA-256 содержимого: повторная загрузка того же изображения
+    # не создает новый файл. Хэш считается за один проход по загрузке
+    try:
+        tmp_path = _upload_tmp_path(file.stream)
+        if tmp_path:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: file.stream.read(1024 * 1024), b''):
+                digest.update(chunk)
+            file.stream.close()
+            filename = f"{digest.hexdigest()}.{ext}"
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            if not _claim_existing(filepath):
+                # Загрузка уже лежит на диске: переносим без повторного копирования
+                os.chmod(tmp_path, UPLOAD_FILE_MODE)
+                os.replace(tmp_path, filepath)
+        else:
+            # Небольшая загрузка (до UPLOAD_MEMORY_THRESHOLD) читается целиком
+            data = file.stream.read()
+            filename = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            if not _claim_existing(filepath):
+                _write_atomic(filepath, data)
     except Exception as e:
-        if os.path.exists(filepath):
-            os.remove(filepath)
         return None, f"Error processing image: {str(e)}"
 
     return filename, None # Возвращаем имя файла для сохранения в БД